@@ -1,10 +1,14 @@
 import os
+import hmac
 import logging
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 from pr_review_bot import pr_webhook, notify_pr_review
 from reaction_handler import slack_events
 from slash_commands import handle_slash_command
+from availability import start_availability_refresher
+from noise_filter import filter_stats
+from reconciliation import start_reconciliation_sweeper
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
@@ -25,6 +29,12 @@ app = Flask(__name__)
 slack_token = os.environ.get('SLACK_BOT_TOKEN')
 client = WebClient(token=slack_token)
 
+# Keep the reviewer availability cache warm in the background
+start_availability_refresher()
+
+# Periodically pick up claims Slack never delivered to us
+start_reconciliation_sweeper()
+
 # Add a root route handler
 @app.route("/", methods=["GET", "POST", "HEAD"])
 def home():
@@ -55,6 +65,19 @@ def events_endpoint():
 
 app.add_url_rule('/slack/commands', view_func=handle_slash_command, methods=['POST'])
 
+# Bearer token that unlocks the PR titles and URLs in /noise-filter/stats;
+# without it the endpoint only reports counters
+NOISE_FILTER_STATS_TOKEN = os.environ.get("NOISE_FILTER_STATS_TOKEN")
+
+@app.route('/noise-filter/stats', methods=['GET'])
+def noise_filter_stats():
+    """Report noise filter hit counters and, to authorized callers, dry-run matches"""
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(NOISE_FILTER_STATS_TOKEN) and hmac.compare_digest(
+        authorization.encode(), f"Bearer {NOISE_FILTER_STATS_TOKEN}".encode()
+    )
+    return jsonify(filter_stats(include_events=authorized))
+
 if __name__ == '__main__':
     # Get port from environment variable or use default
     port = int(os.environ.get("PORT", 8080))
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from slack_sdk.errors import SlackApiError
+from dotenv import load_dotenv
+from workspaces import get_workspace, installed_team_ids, RateLimitBudget, UnknownTeamError
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# How often the roster's availability is refreshed in the background (seconds)
+AVAILABILITY_REFRESH_INTERVAL = int(os.environ.get("AVAILABILITY_REFRESH_INTERVAL", "300"))
+
+# Where the refreshing process publishes its snapshot for every other process.
+# Only the process holding an exclusive flock on AVAILABILITY_LOCK_FILE calls
+# Slack; the rest re-read the snapshot whenever it changes. On a multi-host
+# fleet, keep both files on storage shared by every host.
+AVAILABILITY_CACHE_FILE = os.environ.get("AVAILABILITY_CACHE_FILE", "availability.json")
+AVAILABILITY_LOCK_FILE = os.environ.get("AVAILABILITY_LOCK_FILE", AVAILABILITY_CACHE_FILE + ".lock")
+
+# How often non-refreshing processes check the snapshot for changes (seconds)
+AVAILABILITY_POLL_INTERVAL = int(os.environ.get("AVAILABILITY_POLL_INTERVAL", "15"))
+
+# How many workspaces are refreshed at once; each has its own budget
+AVAILABILITY_REFRESH_WORKERS = int(os.environ.get("AVAILABILITY_REFRESH_WORKERS", "4"))
+
+# Whether to call users_getPresence for each roster member during a refresh
+AVAILABILITY_CHECK_PRESENCE = os.environ.get("AVAILABILITY_CHECK_PRESENCE", "true").lower() == "true"
+
+# Slack calls per minute the refresh may make for each workspace. This is separate
+# from the workspace budget so a refresh never starves live notifications.
+AVAILABILITY_CALLS_PER_MINUTE = int(os.environ.get("AVAILABILITY_CALLS_PER_MINUTE", "20"))
+
+# Optional local out-of-office calendar, e.g.
+# {"U048MPX0KK7": [["2026-10-20", "2026-10-24"]], "UPK3LK5EX": [["2026-12-22", "2027-01-05"]]}
+OOO_CALENDAR_FILE = os.environ.get("OOO_CALENDAR_FILE")
+
+# Slack status emoji and text fragments that mean someone is out
+OOO_STATUS_EMOJI = {":palm_tree:", ":airplane:", ":face_with_thermometer:", ":mask:", ":no_entry:"}
+OOO_STATUS_TEXT = ("ooo", "out of office", "on leave", "vacation", "holiday", "sick")
+
+# team_id -> {user_id: reason}; users missing from the map are available
+_unavailable = {}
+_refresh_lock = threading.Lock()
+
+# team_id -> RateLimitBudget used only by the background refresh
+_refresh_budgets = {}
+_leader_lock_file = None
+_snapshot_mtime = None
+_stop_event = threading.Event()
+_refresher = None
+
+
+def is_available(user_id, team_id=None):
+    """Return whether a user is available to review, using only cached data"""
+    team_id = get_workspace(team_id).team_id
+    return user_id not in _unavailable.get(team_id, {})
+
+
+def unavailable_reason(user_id, team_id=None):
+    """Return why a user is unavailable, or None if they are available"""
+    team_id = get_workspace(team_id).team_id
+    return _unavailable.get(team_id, {}).get(user_id)
+
+
+def _load_ooo_calendar():
+    """Return user_id -> list of (start, end) dates from the OOO calendar file"""
+    if not OOO_CALENDAR_FILE:
+        return {}
+
+    try:
+        with open(OOO_CALENDAR_FILE) as f:
+            raw = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to read OOO calendar {OOO_CALENDAR_FILE}: {e}")
+        return {}
+
+    calendar = {}
+    for user_id, ranges in raw.items():
+        try:
+            calendar[user_id] = [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in ranges]
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid OOO calendar entry for {user_id}: {e}")
+    return calendar
+
+
+def _status_is_ooo(profile):
+    """Whether a Slack profile's custom status says the user is out"""
+    emoji = profile.get('status_emoji') or ''
+    text = (profile.get('status_text') or '').lower()
+    return emoji in OOO_STATUS_EMOJI or any(fragment in text for fragment in OOO_STATUS_TEXT)
+
+
+def refresh_workspace(workspace):
+    """Rebuild the availability map for one workspace's roster"""
+    roster = set(workspace.team_members.values())
+    roster.discard(None)
+    if not roster:
+        return
+
+    client = workspace.client
+    budget = _refresh_budgets.setdefault(workspace.team_id, RateLimitBudget(AVAILABILITY_CALLS_PER_MINUTE))
+    unavailable = {}
+    today = date.today()
+
+    # Local calendar first, it needs no API calls
+    for user_id, ranges in _load_ooo_calendar().items():
+        if user_id in roster and any(start <= today <= end for start, end in ranges):
+            unavailable[user_id] = "out of office (calendar)"
+
+    try:
+        # The roster is small, so fetch just its members rather than paging
+        # through every member of the workspace with users_list
+        for user_id in sorted(roster - set(unavailable)):
+            budget.acquire()
+            user = client.users_info(user=user_id).get('user', {})
+            if user.get('deleted'):
+                unavailable[user_id] = "deactivated"
+            elif _status_is_ooo(user.get('profile', {})):
+                unavailable[user_id] = "out of office (status)"
+
+        # dnd_teamInfo takes a comma-separated list, so DND is one call
+        budget.acquire()
+        response = client.dnd_teamInfo(users=",".join(sorted(roster)))
+        now = time.time()
+        for user_id, dnd in response.get('users', {}).items():
+            if user_id in unavailable:
+                continue
+            in_schedule = (dnd.get('dnd_enabled')
+                           and dnd.get('next_dnd_start_ts', now + 1) <= now < dnd.get('next_dnd_end_ts', 0))
+            if dnd.get('snooze_enabled') or in_schedule:
+                unavailable[user_id] = "do not disturb"
+
+        if AVAILABILITY_CHECK_PRESENCE:
+            for user_id in roster - set(unavailable):
+                budget.acquire()
+                response = client.users_getPresence(user=user_id)
+                if response.get('presence') == 'away':
+                    unavailable[user_id] = "away"
+
+    except SlackApiError as e:
+        # Keep serving the previous snapshot rather than a partial one
+        logger.error(f"Failed to refresh availability for team {workspace.team_id}: {e.response['error']}")
+        return
+
+    with _refresh_lock:
+        _unavailable[workspace.team_id] = unavailable
+    logger.info(f"Refreshed availability for team {workspace.team_id}: {len(unavailable)} unavailable")
+
+
+def _is_leader():
+    """Try to become the one process that refreshes, returning whether we are it"""
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+    lock_file = open(AVAILABILITY_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Held for the life of the process; the OS releases it if we die
+    _leader_lock_file = lock_file
+    logger.info(f"This process (pid {os.getpid()}) is now the availability refresher")
+    return True
+
+
+def _save_snapshot():
+    # Write then rename so readers never see a half-written snapshot
+    tmp_path = AVAILABILITY_CACHE_FILE + ".tmp"
+    try:
+        with _refresh_lock:
+            snapshot = dict(_unavailable)
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, AVAILABILITY_CACHE_FILE)
+    except OSError as e:
+        logger.error(f"Failed to write availability snapshot {AVAILABILITY_CACHE_FILE}: {e}")
+
+
+def _load_snapshot():
+    """Pick up the refreshing process's snapshot if it changed since we last read it"""
+    global _snapshot_mtime
+    try:
+        mtime = os.path.getmtime(AVAILABILITY_CACHE_FILE)
+        if mtime == _snapshot_mtime:
+            return
+        with open(AVAILABILITY_CACHE_FILE) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to read availability snapshot {AVAILABILITY_CACHE_FILE}: {e}")
+        return
+
+    with _refresh_lock:
+        _unavailable.clear()
+        _unavailable.update(snapshot)
+    _snapshot_mtime = mtime
+
+
+def _refresh_team(team_id):
+    try:
+        refresh_workspace(get_workspace(team_id, cache=False))
+    except UnknownTeamError:
+        logger.warning(f"Skipping availability refresh for uninstalled team {team_id}")
+    except Exception as e:
+        logger.error(f"Unexpected error refreshing availability for team {team_id}: {str(e)}")
+
+
+def refresh_all():
+    """Refresh availability for every installed workspace and publish the snapshot"""
+    team_ids = installed_team_ids()
+    if not team_ids:
+        return
+
+    # Workspaces have separate budgets, so a slow tenant shouldn't hold up the rest
+    with ThreadPoolExecutor(max_workers=AVAILABILITY_REFRESH_WORKERS) as pool:
+        list(pool.map(_refresh_team, sorted(team_ids)))
+
+    with _refresh_lock:
+        for team_id in set(_unavailable) - team_ids:
+            del _unavailable[team_id]
+    _save_snapshot()
+
+
+def _refresh_loop():
+    # Adopt whatever the last refresher published before deciding our role
+    _load_snapshot()
+    while not _stop_event.is_set():
+        if _is_leader():
+            refresh_all()
+            _stop_event.wait(AVAILABILITY_REFRESH_INTERVAL)
+        else:
+            _load_snapshot()
+            _stop_event.wait(AVAILABILITY_POLL_INTERVAL)
+
+
+def start_availability_refresher():
+    """Start the background thread that refreshes (or follows) the availability cache"""
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return _refresher
+
+    _stop_event.clear()
+    _refresher = threading.Thread(target=_refresh_loop, name="availability-refresher", daemon=True)
+    _refresher.start()
+    return _refresher
+
+
+def stop_availability_refresher():
+    """Signal the background refresh thread to exit"""
+    _stop_event.set()
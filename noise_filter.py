@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# JSON list of rules evaluated against the pr_data extracted in pr_webhook, e.g.
+# [
+#   {"name": "bot-authors", "field": "author_type", "op": "equals", "value": "Bot"},
+#   {"name": "renovate", "field": "author", "op": "in", "value": ["dependabot[bot]", "renovate[bot]"]},
+#   {"name": "drafts", "field": "draft", "op": "equals", "value": true},
+#   {"name": "wip", "field": "title", "op": "matches", "value": "^\\[?wip\\]?\\b", "ignore_case": true},
+#   {"name": "docs-only", "field": "labels", "op": "in", "value": ["documentation"]},
+#   {"name": "pages-branch", "field": "base_branch", "op": "in", "value": ["gh-pages"]}
+# ]
+# List-valued fields such as labels match if any element matches. "negate": true
+# inverts a rule, e.g. to drop everything not targeting main.
+NOISE_FILTER_RULES_FILE = os.environ.get("NOISE_FILTER_RULES_FILE")
+
+# In dry-run mode matching events are counted and logged but still notified
+NOISE_FILTER_DRY_RUN = os.environ.get("NOISE_FILTER_DRY_RUN", "false").lower() == "true"
+
+# Compiled (name, predicate) pairs, in file order
+_rules = []
+_hits = {}
+_dry_run_events = []
+_stats_lock = threading.Lock()
+
+# How many recent would-be-filtered events to keep for dry-run reports
+DRY_RUN_REPORT_SIZE = 100
+
+
+def _compile_rule(rule):
+    """Turn one declarative rule into a predicate over pr_data"""
+    field = rule.get('field')
+    op = rule.get('op', 'equals')
+    value = rule.get('value')
+    if not isinstance(field, str):
+        raise ValueError(f"Noise filter rule {rule.get('name')} needs a string 'field'")
+
+    if op == 'equals':
+        def test(candidate):
+            return candidate == value
+    elif op == 'in':
+        if not isinstance(value, list) or any(isinstance(option, (list, dict)) for option in value):
+            raise ValueError(f"Noise filter rule {rule.get('name')} needs a list of plain values for 'in'")
+        options = frozenset(value)
+        def test(candidate):
+            return candidate in options
+    elif op == 'matches':
+        if not isinstance(value, str):
+            raise ValueError(f"Noise filter rule {rule.get('name')} needs a regex string for 'matches'")
+        pattern = re.compile(value, re.IGNORECASE if rule.get('ignore_case') else 0)
+        def test(candidate):
+            return isinstance(candidate, str) and pattern.search(candidate) is not None
+    else:
+        raise ValueError(f"Unknown noise filter op '{op}' in rule {rule.get('name')}")
+
+    negate = bool(rule.get('negate'))
+
+    def predicate(pr_data):
+        candidate = pr_data.get(field)
+        if isinstance(candidate, (list, tuple, set)):
+            matched = any(test(item) for item in candidate)
+        else:
+            matched = test(candidate)
+        return matched != negate
+
+    return predicate
+
+
+def load_rules(path=NOISE_FILTER_RULES_FILE):
+    """Compile the rules file, replacing the active rule set"""
+    global _rules
+    if not path:
+        _rules = []
+        return _rules
+
+    with open(path) as f:
+        raw_rules = json.load(f)
+
+    if not isinstance(raw_rules, list):
+        raise ValueError("Noise filter rules file must contain a JSON list of rules")
+
+    compiled = []
+    for index, rule in enumerate(raw_rules):
+        if not isinstance(rule, dict):
+            raise ValueError(f"Noise filter rule {index} must be a JSON object")
+        name = rule.get('name') or f"rule-{index}"
+        compiled.append((name, _compile_rule(rule)))
+
+    with _stats_lock:
+        for name, _ in compiled:
+            _hits.setdefault(name, 0)
+    _rules = compiled
+    logger.info(f"Loaded {len(compiled)} noise filter rules from {path}")
+    return _rules
+
+
+def match_rule(pr_data):
+    """Return the name of the first rule matching pr_data, counting the hit"""
+    for name, predicate in _rules:
+        if predicate(pr_data):
+            with _stats_lock:
+                _hits[name] = _hits.get(name, 0) + 1
+            return name
+    return None
+
+
+def was_filtered_as_draft(pr_data):
+    """Whether this PR was dropped only because it was a draft, without counting a hit"""
+    if NOISE_FILTER_DRY_RUN:
+        return False
+    # A PR that other rules drop anyway was never notified, draft or not
+    as_draft = any(predicate(dict(pr_data, draft=True)) for _, predicate in _rules)
+    as_ready = any(predicate(dict(pr_data, draft=False)) for _, predicate in _rules)
+    return as_draft and not as_ready
+
+
+def should_filter(pr_data):
+    """Return the matching rule name if the event should be dropped, otherwise None"""
+    rule = match_rule(pr_data)
+    if rule is None:
+        return None
+
+    if NOISE_FILTER_DRY_RUN:
+        logger.info(f"[dry run] Noise filter rule '{rule}' would drop PR: {pr_data.get('url')}")
+        with _stats_lock:
+            _dry_run_events.append({'rule': rule, 'url': pr_data.get('url'), 'title': pr_data.get('title')})
+            del _dry_run_events[:-DRY_RUN_REPORT_SIZE]
+        return None
+
+    logger.info(f"Noise filter rule '{rule}' dropped PR: {pr_data.get('url')}")
+    return rule
+
+
+def filter_stats(include_events=False):
+    """Return per-rule hit counters and, if asked, recent would-be drops in dry-run mode"""
+    with _stats_lock:
+        stats = {
+            'dry_run': NOISE_FILTER_DRY_RUN,
+            'hits': dict(_hits),
+        }
+        if include_events:
+            # Titles and URLs of possibly private PRs
+            stats['would_filter'] = list(_dry_run_events)
+        return stats
+
+
+try:
+    load_rules()
+except (OSError, ValueError, KeyError, re.error) as e:
+    # A broken rules file shouldn't take the webhook down, just disable filtering
+    logger.error(f"Failed to load noise filter rules from {NOISE_FILTER_RULES_FILE}: {e}")
+    _rules = []
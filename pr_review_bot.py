@@ -9,6 +9,11 @@ import json
 import traceback
 import hmac
 import hashlib
+from workspaces import register_installation, get_workspace, UnknownTeamError, SLACK_INSTALLATIONS_FILE, DEFAULT_TEAM_ID
+from availability import is_available
+from tracing import traced, current_span, SPAN_KIND_SERVER
+from noise_filter import should_filter, was_filtered_as_draft
+from reconciliation import record_notification
 
 # Load environment variables
 load_dotenv()
@@ -22,11 +27,9 @@ logger = logging.getLogger(__name__)
 
 # Slack configuration
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
-if not SLACK_BOT_TOKEN:
-    logger.error("SLACK_BOT_TOKEN not found in environment variables")
-    raise ValueError("SLACK_BOT_TOKEN must be set")
-
-client = WebClient(token=SLACK_BOT_TOKEN)
+if not SLACK_BOT_TOKEN and not SLACK_INSTALLATIONS_FILE:
+    logger.error("Neither SLACK_BOT_TOKEN nor SLACK_INSTALLATIONS_FILE found in environment variables")
+    raise ValueError("SLACK_BOT_TOKEN or SLACK_INSTALLATIONS_FILE must be set")
 
 # PR review channel
 PR_REVIEW_CHANNEL = os.environ.get("PR_REVIEW_CHANNEL", "model-pr-review")
@@ -67,20 +70,48 @@ else:
         "Lachlan": "UPK3LK5EX",
     }
 
-# Last selected reviewers to ensure fair rotation
-last_selected = []
+# Register the legacy single-token install as the default workspace
+if SLACK_BOT_TOKEN:
+    register_installation(DEFAULT_TEAM_ID, {
+        'bot_token': SLACK_BOT_TOKEN,
+        'channel': PR_REVIEW_CHANNEL,
+        'primary_reviewer': ["Nigel", NIGEL_ID],
+        'team_members': TEAM_MEMBERS,
+        'github_to_slack': GITHUB_TO_SLACK,
+    })
+
+# Seconds to wait for a tenant's rate-limit budget before giving up on a post
+SLACK_RATE_LIMIT_WAIT = float(os.environ.get("SLACK_RATE_LIMIT_WAIT", "10"))
 
 # Emoji that indicates claiming a review
 CLAIM_EMOJI = "white_check_mark"
 
-def send_slack_message(text, channel=PR_REVIEW_CHANNEL, username='PR Review Bot', icon_emoji=':robot_face:'):
+@traced("send_slack_message")
+def send_slack_message(text, channel=None, username='PR Review Bot', icon_emoji=':robot_face:', team_id=None):
     """Send a message to Slack channel"""
+    workspace = get_workspace(team_id)
+    channel = channel or workspace.channel or PR_REVIEW_CHANNEL
+
+    if not workspace.rate_limit.acquire(timeout=SLACK_RATE_LIMIT_WAIT):
+        logger.error(f"Rate limit budget exhausted for team {workspace.team_id}, dropping message")
+        return None
+
+    # Stamp the post with its trace so a later claim can be linked back to it
+    span = current_span()
+    metadata = None
+    if span is not None:
+        metadata = {
+            "event_type": "pr_review_notification",
+            "event_payload": {"trace_id": span.trace_id, "span_id": span.span_id}
+        }
+    
     try:
-        response = client.chat_postMessage(
+        response = workspace.client.chat_postMessage(
             channel=channel,
             text=text,
             username=username,
-            icon_emoji=icon_emoji
+            icon_emoji=icon_emoji,
+            metadata=metadata
         )
         logger.info(f"Message sent to channel {channel}")
         return response
@@ -88,10 +119,23 @@ def send_slack_message(text, channel=PR_REVIEW_CHANNEL, username='PR Review Bot'
         logger.error(f"Failed to send Slack message: {e.response['error']}")
         return None
 
-def select_reviewers(author_id=None):
-    """Select reviewers for PR review"""
-    global last_selected
+def pick_reviewers(members, count, last_selected):
+    """Pick up to count members, prioritizing those who haven't been selected recently"""
+    not_recently_selected = [member for member in members if member[0] not in last_selected]
     
+    if len(not_recently_selected) >= count:
+        return random.sample(not_recently_selected, count)
+    
+    # If we don't have enough not recently selected, mix in some previously selected
+    recently_selected = [member for member in members if member[0] in last_selected]
+    return not_recently_selected + random.sample(
+        recently_selected,
+        min(count - len(not_recently_selected), len(recently_selected))
+    )
+
+@traced("select_reviewers")
+def select_reviewers(author_id=None, team_id=None):
+    """Select reviewers for PR review"""
     if TESTING_MODE:
         # In testing mode, just use predefined reviewers
         reviewers = [("Nigel", "Nigel (Test)")]
@@ -106,44 +150,47 @@ def select_reviewers(author_id=None):
             
         return reviewers + selected
     
-    # Normal production mode
-    # Nigel is always a reviewer
-    reviewers = [("Nigel", NIGEL_ID)]
+    # Normal production mode, using the tenant's roster
+    workspace = get_workspace(team_id)
+    primary_name, primary_id = workspace.primary_reviewer
     
-    # Get all team members except Nigel and the author
-    available_members = [(name, user_id) for name, user_id in TEAM_MEMBERS.items() 
-                        if name != "Nigel" and user_id != NIGEL_ID and user_id != author_id]
+    # The tenant's primary reviewer is always a reviewer
+    reviewers = [(primary_name, primary_id)]
     
-    # Prioritize members who haven't been selected recently
-    not_recently_selected = [member for member in available_members 
-                           if member[0] not in last_selected]
+    # Get all team members except the primary reviewer and the author
+    available_members = [(name, user_id) for name, user_id in workspace.team_members.items() 
+                        if name != primary_name and user_id != primary_id and user_id != author_id]
     
-    if len(not_recently_selected) >= 2:
-        selected = random.sample(not_recently_selected, 2)
-    else:
-        # If we don't have enough not recently selected, mix in some previously selected
-        selected = not_recently_selected + random.sample(
-            [m for m in available_members if m[0] not in [nm[0] for nm in not_recently_selected]],
-            2 - len(not_recently_selected)
-        )
+    # Prefer people who aren't on leave, in DND or away, and only fill any
+    # remaining slots from the rest. This only reads the background-refreshed
+    # cache, no Slack calls here.
+    present_members = [member for member in available_members if is_available(member[1], team_id)]
+    absent_members = [member for member in available_members if member not in present_members]
+    
+    selected = pick_reviewers(present_members, 2, workspace.last_selected)
+    if len(selected) < 2:
+        logger.warning(f"Only {len(present_members)} reviewers available, filling from unavailable members")
+        selected += pick_reviewers(absent_members, 2 - len(selected), workspace.last_selected)
     
     # Update last selected
-    last_selected = [s[0] for s in selected]
+    workspace.last_selected = [s[0] for s in selected]
     
-    # Return Nigel plus the two selected members
+    # Return the primary reviewer plus the two selected members
     return reviewers + selected
 
+@traced("notify_pr_review")
 def notify_pr_review(pr_data):
     """Notify about a new PR that needs review"""
     # Use mapped Slack ID if available, otherwise use the author name
     author = pr_data.get('author', 'Unknown')
     author_id = pr_data.get('author_slack_id')  # This can be None if no mapping exists
+    team_id = pr_data.get('team_id')
     
     # Log the author information
     logger.info(f"PR Author: GitHub username={author}, Slack ID={author_id}")
     
     # Select reviewers excluding the author's Slack ID
-    reviewers = select_reviewers(author_id)
+    reviewers = select_reviewers(author_id, team_id=team_id)
     
     # Primary reviewer is always the first one (Nigel)
     primary_reviewer = reviewers[0]
@@ -187,14 +234,15 @@ def notify_pr_review(pr_data):
             f"React with :{CLAIM_EMOJI}: to claim this review."
         )
     
-    # Use the specified channel if provided, otherwise use the default PR_REVIEW_CHANNEL
-    channel = pr_data.get('channel', PR_REVIEW_CHANNEL)
+    # Use the specified channel if provided, otherwise the tenant's default channel
+    channel = pr_data.get('channel')
     
     # Send the message
-    response = send_slack_message(message, channel=channel)
+    response = send_slack_message(message, channel=channel, team_id=team_id)
     
     if response and response['ok']:
         logger.info(f"PR review notification sent, timestamp: {response['ts']}")
+        record_notification(team_id, response['channel'], response['ts'])
         return response
     else:
         logger.error("Failed to send PR review notification")
@@ -223,6 +271,7 @@ def verify_github_webhook(request_data, signature_header):
     # Compare signatures
     return hmac.compare_digest(signature_header, expected_signature)
 
+@traced("pr_webhook", kind=SPAN_KIND_SERVER)
 def pr_webhook():
     """Webhook endpoint to receive PR notifications"""
     try:
@@ -232,6 +281,7 @@ def pr_webhook():
         # Get the event type
         event_type = request.headers.get('X-GitHub-Event')
         logger.info(f"GitHub Event Type: {event_type}")
+        current_span().set_attribute('github.event', event_type)
         
         # Get the signature
         signature = request.headers.get('X-Hub-Signature-256')
@@ -241,6 +291,16 @@ def pr_webhook():
             logger.error("Invalid GitHub webhook signature")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         
+        # GitHub doesn't know about Slack workspaces, so each tenant's webhook
+        # URL carries its team_id, e.g. /webhook/pr?team_id=T0001. Only look it
+        # up once the request is known to come from GitHub.
+        team_id = request.args.get('team_id')
+        try:
+            github_to_slack = get_workspace(team_id).github_to_slack
+        except UnknownTeamError:
+            logger.error(f"Unknown Slack team in webhook URL: {team_id}")
+            return jsonify({"status": "error", "message": f"Unknown team: {team_id}"}), 404
+        
         data = request.json
         logger.info(f"Received webhook payload: {data}")
         
@@ -252,11 +312,11 @@ def pr_webhook():
         
         if event_type == 'pull_request':
             # Handle pull_request event
-            if data.get('action') == 'opened' or data.get('action') == 'reopened':
+            if data.get('action') in ('opened', 'reopened', 'ready_for_review'):
                 github_author = data.get('pull_request', {}).get('user', {}).get('login')
                 
                 # Map GitHub username to Slack ID if possible
-                slack_author = GITHUB_TO_SLACK.get(github_author)
+                slack_author = github_to_slack.get(github_author)
                 logger.info(f"Mapped GitHub author {github_author} to Slack ID {slack_author}")
                 
                 pr_data = {
@@ -264,7 +324,8 @@ def pr_webhook():
                     'repository': data.get('repository', {}).get('full_name', 'Unknown repository'),
                     'author': github_author,
                     'author_slack_id': slack_author,  # This is the key change
-                    'url': data.get('pull_request', {}).get('html_url', '#')
+                    'url': data.get('pull_request', {}).get('html_url', '#'),
+                    'team_id': team_id
                 }
             else:
                 # Not an event we care about
@@ -275,7 +336,7 @@ def pr_webhook():
             github_author = data.get('pull_request', {}).get('user', {}).get('login')
             
             # Map GitHub username to Slack ID if possible
-            slack_author = GITHUB_TO_SLACK.get(github_author)
+            slack_author = github_to_slack.get(github_author)
             logger.info(f"Mapped GitHub author {github_author} to Slack ID {slack_author}")
             
             pr_data = {
@@ -284,13 +345,36 @@ def pr_webhook():
                 'author': github_author,
                 'author_slack_id': slack_author,
                 'url': data.get('pull_request', {}).get('html_url', '#'),
-                'reviewer': data.get('review', {}).get('user', {}).get('login', 'Unknown')
+                'reviewer': data.get('review', {}).get('user', {}).get('login', 'Unknown'),
+                'team_id': team_id
             }
         else:
             return jsonify({"status": "error", "message": f"Unsupported event type: {event_type}"}), 400
         
         # Only proceed if we have valid PR data
         if pr_data:
+            # Extra fields the noise filter rules can match on
+            pull_request = data.get('pull_request', {})
+            pr_data.update({
+                'action': data.get('action'),
+                'author_type': pull_request.get('user', {}).get('type'),
+                'draft': pull_request.get('draft', False),
+                'base_branch': pull_request.get('base', {}).get('ref'),
+                'head_branch': pull_request.get('head', {}).get('ref'),
+                'labels': [label.get('name') for label in pull_request.get('labels', [])],
+            })
+            
+            # Drafts become notifiable when marked ready, unless they were
+            # already notified when opened
+            if pr_data['action'] == 'ready_for_review' and not was_filtered_as_draft(pr_data):
+                return jsonify({"status": "skipped", "message": "PR was already notified when opened"}), 200
+            
+            # Drop bot, draft and other noisy PRs before any Slack work
+            filtered_by = should_filter(pr_data)
+            if filtered_by:
+                current_span().set_attribute('noise_filter.rule', filtered_by)
+                return jsonify({"status": "skipped", "message": f"Filtered by noise rule: {filtered_by}"}), 200
+            
             # Notify about the PR
             response = notify_pr_review(pr_data)
             
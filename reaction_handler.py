@@ -1,10 +1,14 @@
 import os
 import logging
 import json
+import threading
+from collections import OrderedDict
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from flask import Flask, request, jsonify, Response
-from pr_review_bot import select_reviewers, CLAIM_EMOJI
+from pr_review_bot import notify_pr_review, CLAIM_EMOJI
+from workspaces import get_client, get_workspace, UnknownTeamError, SLACK_INSTALLATIONS_FILE
+from tracing import traced, current_span, SPAN_KIND_SERVER
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -19,92 +23,32 @@ logger = logging.getLogger(__name__)
 
 # Slack configuration from environment variables
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
-if not SLACK_BOT_TOKEN:
-    logger.error("SLACK_BOT_TOKEN not found in environment variables")
-    raise ValueError("SLACK_BOT_TOKEN must be set")
+if not SLACK_BOT_TOKEN and not SLACK_INSTALLATIONS_FILE:
+    logger.error("Neither SLACK_BOT_TOKEN nor SLACK_INSTALLATIONS_FILE found in environment variables")
+    raise ValueError("SLACK_BOT_TOKEN or SLACK_INSTALLATIONS_FILE must be set")
 
 NIGEL_ID = os.environ.get("NIGEL_ID", "U0123456789")
 PR_REVIEW_CHANNEL = os.environ.get("PR_REVIEW_CHANNEL", "pr-reviews")
 CLAIM_EMOJI = "white_check_mark"
 
-# Initialize Slack client
-client = WebClient(token=SLACK_BOT_TOKEN)
+# Slack event handlers keyed on (event type, subtype)
+EVENT_HANDLERS = {}
 
-def handle_reaction(event_data):
-    """Handle reaction added events for PR review claims"""
-    try:
-        # Check if it's the claim emoji
-        if event_data.get('reaction') != CLAIM_EMOJI:
-            return {"status": "ignored", "reason": "Not a claim emoji"}
-            
-        # Get event details
-        user_id = event_data.get('user')
-        item = event_data.get('item', {})
-        channel = item.get('channel')
-        timestamp = item.get('ts')
-        
-        if not all([user_id, channel, timestamp]):
-            return {"status": "error", "reason": "Missing required event data"}
-            
-        # Get the original message to check if it's a PR review message
-        try:
-            result = client.conversations_history(
-                channel=channel,
-                inclusive=True,
-                latest=timestamp,
-                limit=1
-            )
-            
-            if not result['ok'] or not result['messages']:
-                return {"status": "error", "reason": "Couldn't retrieve original message"}
-                
-            original_message = result['messages'][0]
-            
-            # Check if this is a PR review message (by looking for our specific text)
-            if "New PR Needs Review:" not in original_message.get('text', ''):
-                return {"status": "ignored", "reason": "Not a PR review message"}
-                
-            # Check if the user is one of the additional reviewers
-            if user_id not in original_message.get('text', ''):
-                return {"status": "ignored", "reason": "User not an assigned reviewer"}
-                
-            # Get user information
-            user_info = client.users_info(user=user_id)
-            if not user_info['ok']:
-                logger.error(f"Failed to get user info: {user_info.get('error')}")
-                reviewer_name = "Unknown User"
-            else:
-                reviewer_name = user_info['user'].get('real_name', user_info['user'].get('name', 'Unknown User'))
-                
-            # Update the original message
-            updated_text = original_message.get('text', '') + f"\n\n*Review claimed by <@{user_id}> ({reviewer_name})!*"
-            
-            update_response = client.chat_update(
-                channel=channel,
-                ts=timestamp,
-                text=updated_text
-            )
-            
-            # Notify Nigel
-            dm_channel = client.conversations_open(users=NIGEL_ID)
-            if dm_channel['ok']:
-                client.chat_postMessage(
-                    channel=dm_channel['channel']['id'],
-                    text=f"*PR Review Update:* <@{user_id}> ({reviewer_name}) has claimed the review for the PR.\n"
-                         f"*Original Message:* https://slack.com/archives/{channel}/p{timestamp.replace('.', '')}"
-                )
-                
-            return {"status": "success", "reviewer": reviewer_name}
-            
-        except SlackApiError as e:
-            logger.error(f"Error processing reaction: {e.response['error']}")
-            return {"status": "error", "reason": str(e.response['error'])}
-            
-    except Exception as e:
-        logger.error(f"Unexpected error processing reaction: {str(e)}")
-        return {"status": "error", "reason": str(e)}
+# Recently handled event_ids, so Slack's retries don't repeat a notification
+EVENT_DEDUP_SIZE = 1000
+_seen_event_ids = OrderedDict()
+_seen_lock = threading.Lock()
 
-def handle_pr_command(event_data):
+def on_event(event_type, subtype=None):
+    """Register a handler for a Slack event type and optional subtype"""
+    def decorator(func):
+        EVENT_HANDLERS[(event_type, subtype)] = func
+        return func
+    return decorator
+
+@on_event("message")
+@traced("handle_pr_command")
+def handle_pr_command(event_data, team_id=None):
     """Handle messages with -pr command for PR review assignments"""
     try:
         # Get message text and user
@@ -115,6 +59,8 @@ def handle_pr_command(event_data):
         # Check if this is a -pr command
         if not text.startswith('-pr '):
             return {"status": "ignored", "reason": "Not a PR command"}
+        
+        client = get_client(team_id)
             
         # Parse the command: -pr URL Title
         parts = text[4:].strip().split(' ', 1)  # Split into URL and title
@@ -125,19 +71,39 @@ def handle_pr_command(event_data):
             )
             return {"status": "error", "reason": "Invalid command format"}
             
-        # ...rest of the handle_pr_command implementation...
+        url = parts[0]
+        title = parts[1]
+        
+        pr_data = {
+            'title': title,
+            'repository': 'Manual Request',
+            'author': f"<@{user_id}>",
+            'author_slack_id': user_id,
+            'url': url,
+            'channel': channel,
+            'team_id': team_id
+        }
+        
+        response = notify_pr_review(pr_data)
+        if response and response['ok']:
+            return {"status": "success", "message": "PR review request created"}
+        else:
+            return {"status": "error", "reason": "Failed to send message"}
     
     except Exception as e:
         logger.error(f"Unexpected error processing PR command: {str(e)}")
         return {"status": "error", "reason": str(e)}
 
-def handle_mention(event_data):
+@on_event("app_mention")
+@traced("handle_mention")
+def handle_mention(event_data, team_id=None):
     """Handle when someone mentions the bot"""
     try:
         # Get message text and user
         text = event_data.get('text', '')
         user_id = event_data.get('user')
         channel = event_data.get('channel')
+        client = get_client(team_id)
         
         # Remove the bot mention from text
         # Example: "<@BOT_ID> https://github.com/repo/pull/123 Add feature"
@@ -164,38 +130,20 @@ def handle_mention(event_data):
         url = content_parts[0]
         title = content_parts[1]
         
-        # Get user info of the requester
-        user_info = client.users_info(user=user_id)
-        requester_name = "Unknown User"
-        if user_info['ok']:
-            requester_name = user_info['user'].get('real_name', user_info['user'].get('name', 'Unknown User'))
+        # Post through the normal notification path so mentions get the tenant
+        # rate budget, trace metadata and claim reconciliation too
+        pr_data = {
+            'title': title,
+            'repository': 'Manual Request',
+            'author': f"<@{user_id}>",
+            'author_slack_id': user_id,
+            'url': url,
+            'channel': channel,
+            'team_id': team_id
+        }
         
-        # Select reviewers - pass the author's user_id to exclude them from selection
-        reviewers = select_reviewers(user_id)
-        
-        # Primary reviewer is always the first one (Nigel)
-        primary_reviewer = reviewers[0]
-        additional_reviewers = reviewers[1:]
-        
-        # Construct the message
-        message = (
-            f"*New PR Needs Review:* {title}\n"
-            f"*Repository:* Manual Request\n"
-            f"*Author:* {requester_name}\n"
-            f"*URL:* {url}\n\n"
-            f"*Primary Reviewer:* <@{primary_reviewer[1]}>\n"
-            f"*Additional Reviewers (one needed):* " + 
-            " or ".join([f"<@{user_id}>" for _, user_id in additional_reviewers]) + "\n\n"
-            f"React with :{CLAIM_EMOJI}: to claim this review."
-        )
-        
-        # Send the message
-        response = client.chat_postMessage(
-            channel=channel,
-            text=message
-        )
-        
-        if response['ok']:
+        response = notify_pr_review(pr_data)
+        if response and response['ok']:
             return {"status": "success", "message": "PR review request created"}
         else:
             return {"status": "error", "reason": "Failed to send message"}
@@ -210,6 +158,7 @@ def handle_pr_slash_command():
     from slash_commands import handle_slash_command
     return handle_slash_command()
 
+@traced("slack_events", kind=SPAN_KIND_SERVER)
 def slack_events():
     """Handle Slack events including reactions"""
     # First, print the raw request data for debugging
@@ -231,11 +180,33 @@ def slack_events():
                     # This is critical for Slack API validation
                     return {"challenge": challenge}
                 
-                # Handle reaction events
                 event = payload.get('event', {})
-                if event.get('type') == 'reaction_added':
-                    logger.info(f"Processing reaction event: {event}")
-                    handle_reaction(event)
+                team_id = payload.get('team_id')
+                
+                # Drop event types and subtypes nobody handles before any other work
+                handler = EVENT_HANDLERS.get((event.get('type'), event.get('subtype')))
+                if handler is None:
+                    return jsonify({"status": "ignored"})
+                
+                # Slack retries slow deliveries; handle each event_id once
+                if is_duplicate_delivery(payload):
+                    logger.info(f"Ignoring duplicate delivery of event {payload.get('event_id')}")
+                    return jsonify({"status": "ignored"})
+                
+                try:
+                    # Never react to our own messages or reactions
+                    if is_own_event(event, team_id):
+                        return jsonify({"status": "ignored"})
+                    
+                    logger.info(f"Dispatching {event.get('type')} event to {handler.__name__}")
+                    handler(event, team_id=team_id)
+                except UnknownTeamError:
+                    # Not installed here; a 500 would only make Slack retry it
+                    logger.warning(f"Ignoring event from unknown team {team_id}")
+                    return jsonify({"status": "ignored"})
+                except Exception:
+                    forget_event(payload)
+                    raise
                 
                 # Always return a 200 OK for events
                 return jsonify({"status": "ok"})
@@ -250,9 +221,45 @@ def slack_events():
         logger.error(f"Error processing event: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-def handle_reaction(event):
-    """Handle the reaction event"""
+def is_duplicate_delivery(payload):
+    """Whether this process has already taken on this event"""
+    # Only event IDs seen by this process are dropped, so a retry of a delivery
+    # whose worker died is handled by whichever worker gets it. A retry that
+    # lands on another worker while the first is still running is handled
+    # twice; missed claims are left to the reconciliation sweep, not to retries.
+    event_id = payload.get('event_id')
+    if not event_id:
+        return False
+    with _seen_lock:
+        if event_id in _seen_event_ids:
+            return True
+        _seen_event_ids[event_id] = True
+        while len(_seen_event_ids) > EVENT_DEDUP_SIZE:
+            _seen_event_ids.popitem(last=False)
+    return False
+
+def forget_event(payload):
+    """Let a retry of a failed event through again"""
+    with _seen_lock:
+        _seen_event_ids.pop(payload.get('event_id'), None)
+
+def is_own_event(event, team_id=None):
+    """Whether an event was caused by this bot, using its cached identity"""
+    try:
+        bot_user_id, bot_id = get_workspace(team_id).bot_identity()
+    except SlackApiError as e:
+        logger.error(f"Failed to look up bot identity: {e.response['error']}")
+        return False
+    if bot_user_id and event.get('user') == bot_user_id:
+        return True
+    return bool(bot_id) and event.get('bot_id') == bot_id
+
+@on_event("reaction_added")
+@traced("handle_reaction")
+def handle_reaction(event, team_id=None, message=None):
+    """Handle the reaction event, optionally with the reacted-to message already fetched"""
     reaction = event.get('reaction')
+    client = get_client(team_id)
     
     # Check if this is the claim emoji
     if reaction == CLAIM_EMOJI:
@@ -266,20 +273,26 @@ def handle_reaction(event):
             return
         
         try:
-            # Get the message that was reacted to
-            message_response = client.conversations_history(
-                channel=channel,
-                inclusive=True,
-                oldest=ts,
-                latest=ts,
-                limit=1
-            )
-            
-            if not message_response['ok'] or not message_response['messages']:
-                logger.error("Failed to fetch message or no messages found")
-                return
+            # Get the message that was reacted to, unless the caller already has it
+            if message is None:
+                message_response = client.conversations_history(
+                    channel=channel,
+                    inclusive=True,
+                    oldest=ts,
+                    latest=ts,
+                    limit=1,
+                    include_all_metadata=True
+                )
+                
+                if not message_response['ok'] or not message_response['messages']:
+                    logger.error("Failed to fetch message or no messages found")
+                    return
+                
+                message = message_response['messages'][0]
             
-            message = message_response['messages'][0]
+            # Link the claim to the trace of the notification it claims
+            pr_trace = message.get('metadata', {}).get('event_payload', {})
+            current_span().add_link(pr_trace.get('trace_id'), pr_trace.get('span_id'))
             
             # Check if this is a PR review message (contains the claim emoji message)
             if "React with :" + CLAIM_EMOJI + ": to claim this review." in message.get('text', ''):
@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from slack_sdk.errors import SlackApiError
+from dotenv import load_dotenv
+from workspaces import get_workspace, cached_workspaces, RateLimitBudget, UnknownTeamError
+from tracing import traced
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Where per-channel history cursors and open notifications are persisted
+RECONCILE_STATE_FILE = os.environ.get("RECONCILE_STATE_FILE", "reconcile_state.json")
+
+# Only one process sweeps at a time: every process may start the sweeper thread,
+# but it only sweeps while holding an exclusive flock on RECONCILE_LOCK_FILE, so
+# one gunicorn worker owns the state file and the others stand by to take over.
+# Other processes hand the notifications they post to the sweeper through an
+# append-only pending file. On a multi-host fleet, either keep these files on
+# storage shared by every host, or set RECONCILE_SWEEPER=false on all hosts but
+# one; hosts that never sweep don't record notifications, so list the channels
+# they post to in each installation's "reconcile_channels".
+RECONCILE_LOCK_FILE = os.environ.get("RECONCILE_LOCK_FILE", RECONCILE_STATE_FILE + ".lock")
+RECONCILE_PENDING_FILE = RECONCILE_STATE_FILE + ".pending"
+RECONCILE_SWEEPER = os.environ.get("RECONCILE_SWEEPER", "true").lower() == "true"
+
+# How often the sweep runs (seconds)
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "600"))
+
+# Maximum Slack Web API calls a single sweep may make per workspace, including
+# the calls made to replay missed claims
+RECONCILE_CALLS_PER_SWEEP = int(os.environ.get("RECONCILE_CALLS_PER_SWEEP", "20"))
+
+# Slack calls per minute the sweep may make for each workspace. This is separate
+# from the workspace budget so a sweep never starves live notifications.
+RECONCILE_CALLS_PER_MINUTE = int(os.environ.get("RECONCILE_CALLS_PER_MINUTE", "20"))
+
+# How far back the first sweep of a channel looks (seconds)
+RECONCILE_LOOKBACK = int(os.environ.get("RECONCILE_LOOKBACK", "86400"))
+
+# Open notifications older than this are no longer checked (seconds)
+RECONCILE_MAX_AGE = int(os.environ.get("RECONCILE_MAX_AGE", str(7 * 86400)))
+
+# Emoji that indicates claiming a review, and the prompt on unclaimed notifications
+CLAIM_EMOJI = "white_check_mark"
+CLAIM_PROMPT = f"React with :{CLAIM_EMOJI}: to claim this review."
+
+# Replaying a claim with the message in hand costs chat_update + chat_postMessage
+CLAIM_REPLAY_CALLS = 2
+
+# team_id -> {"cursors": {channel: ts}, "open": {channel: [ts, ...]},
+#             "backfill": {channel: {"top": ts, "latest": ts}}, "rotation": n}
+# A backfill is a range of history read newest-first that a sweep ran out of
+# budget part way through: everything from "latest" up to "top" is done.
+_state = {}
+_state_lock = threading.Lock()
+_leader_lock_file = None
+
+# team_id -> RateLimitBudget used only by the sweep
+_sweep_budgets = {}
+_stop_event = threading.Event()
+_sweeper = None
+
+
+def _load_state():
+    global _state
+    # Re-read every sweep, since the sweeping process can change hands
+    try:
+        with open(RECONCILE_STATE_FILE) as f:
+            _state = json.load(f)
+    except FileNotFoundError:
+        _state = {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to read reconcile state {RECONCILE_STATE_FILE}: {e}")
+        _state = {}
+    return _state
+
+
+def _save_state():
+    # Write then rename so a crash never leaves a half-written cursor file
+    tmp_path = RECONCILE_STATE_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(_state, f)
+        os.replace(tmp_path, RECONCILE_STATE_FILE)
+    except OSError as e:
+        logger.error(f"Failed to write reconcile state {RECONCILE_STATE_FILE}: {e}")
+
+
+def _team_state(team_id):
+    team_state = _state.setdefault(team_id, {"cursors": {}, "open": {}})
+    team_state.setdefault("backfill", {})
+    return team_state
+
+
+def _is_leader():
+    """Try to become the one process that sweeps, returning whether we are it"""
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+    lock_file = open(RECONCILE_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Held for the life of the process; the OS releases it if we die
+    _leader_lock_file = lock_file
+    logger.info(f"This process (pid {os.getpid()}) is now the reconciliation sweeper")
+    return True
+
+
+def record_notification(team_id, channel, ts):
+    """Remember a posted notification so the sweep can check it for missed claims"""
+    if not RECONCILE_SWEEPER:
+        # Nothing on this host will ever merge the pending file
+        return
+    team_id = get_workspace(team_id).team_id
+    try:
+        with open(RECONCILE_PENDING_FILE, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps([team_id, channel, ts]) + "\n")
+    except OSError as e:
+        # The history sweep still finds the notification by its text
+        logger.error(f"Failed to record notification {channel}/{ts}: {e}")
+
+
+def _merge_pending():
+    """Move notifications recorded by any process into the state"""
+    try:
+        with open(RECONCILE_PENDING_FILE, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            lines = f.readlines()
+            f.truncate(0)
+    except OSError as e:
+        logger.error(f"Failed to read pending notifications {RECONCILE_PENDING_FILE}: {e}")
+        return
+
+    for line in lines:
+        try:
+            team_id, channel, ts = json.loads(line)
+        except (ValueError, TypeError):
+            continue
+        open_ts = _team_state(team_id)["open"].setdefault(channel, [])
+        if ts not in open_ts:
+            open_ts.append(ts)
+
+
+class _CallBudget:
+    """Counts the Web API calls one sweep makes against RECONCILE_CALLS_PER_SWEEP"""
+
+    def __init__(self, workspace):
+        self.rate_limit = _sweep_budgets.setdefault(workspace.team_id, RateLimitBudget(RECONCILE_CALLS_PER_MINUTE))
+        self.remaining = RECONCILE_CALLS_PER_SWEEP
+
+    def spend(self, cost=1):
+        if self.remaining < cost:
+            return False
+        # A minute refills the whole bucket, so waiting longer means something is wrong
+        if not self.rate_limit.acquire(cost, timeout=60):
+            return False
+        self.remaining -= cost
+        return True
+
+
+def _claimer(message, bot_user_id):
+    """Return the first non-bot user who reacted with the claim emoji, if any"""
+    for reaction in message.get('reactions', []):
+        if reaction.get('name') == CLAIM_EMOJI:
+            for user_id in reaction.get('users', []):
+                if user_id != bot_user_id:
+                    return user_id
+    return None
+
+
+def _apply_claim(workspace, channel, message, user_id, budget):
+    """Replay a missed claim through the normal reaction_added handler"""
+    from reaction_handler import handle_reaction
+
+    if not budget.spend(CLAIM_REPLAY_CALLS):
+        return False
+
+    logger.info(f"Reconciling missed claim by {user_id} on {channel}/{message['ts']}")
+    handle_reaction({
+        'type': 'reaction_added',
+        'user': user_id,
+        'reaction': CLAIM_EMOJI,
+        'item': {'type': 'message', 'channel': channel, 'ts': message['ts']}
+    }, team_id=workspace.team_id, message=message)
+    return True
+
+
+def _handle_message(workspace, channel, message, open_ts, budget, bot_user_id):
+    """Track or replay one message; return False if its claim is out of budget"""
+    ts = message['ts']
+
+    # Claimed already (or edited away from a notification)
+    if CLAIM_PROMPT not in message.get('text', ''):
+        if ts in open_ts:
+            open_ts.remove(ts)
+        return True
+
+    user_id = _claimer(message, bot_user_id)
+    if user_id is not None and _apply_claim(workspace, channel, message, user_id, budget):
+        if ts in open_ts:
+            open_ts.remove(ts)
+        return True
+
+    # Unclaimed, or claimed but the replay has to wait for the next sweep
+    if ts not in open_ts:
+        open_ts.append(ts)
+    return user_id is None
+
+
+def _read_new_messages(workspace, channel, team_state, open_ts, budget, bot_user_id, fresh):
+    """Read history past the channel's cursor; return False if out of budget"""
+    cursors = team_state["cursors"]
+    backfills = team_state["backfill"]
+    # Pin the first sweep's starting point so a backfill's range stays put
+    oldest = cursors.setdefault(channel, f"{time.time() - RECONCILE_LOOKBACK:.6f}")
+
+    # History comes newest-first, so resume an unfinished range below the
+    # part already handled rather than starting over from the newest message
+    backfill = backfills.get(channel) or {}
+    top = backfill.get("top")
+    latest = backfill.get("latest")
+    done_to = None
+    page = None
+    exhausted = False
+    while not exhausted and budget.spend():
+        response = workspace.client.conversations_history(
+            channel=channel, oldest=oldest, latest=latest, cursor=page, limit=200,
+            include_all_metadata=True
+        )
+        for message in response.get('messages', []):
+            top = top or message['ts']
+            fresh.add(message['ts'])
+            if not _handle_message(workspace, channel, message, open_ts, budget, bot_user_id):
+                exhausted = True
+                break
+            done_to = message['ts']
+        else:
+            page = response.get('response_metadata', {}).get('next_cursor')
+            if not page:
+                # The whole range is done, so the next sweep starts above it
+                backfills.pop(channel, None)
+                if top is not None:
+                    cursors[channel] = top
+                return True
+
+    # Out of budget: keep what was handled so the next sweep carries on below it
+    if done_to is not None:
+        backfills[channel] = {"top": top, "latest": done_to}
+    return False
+
+
+def _check_open(workspace, channel, open_ts, budget, bot_user_id, fresh):
+    """Look up each open notification for a claim; return False if out of budget"""
+    for ts in list(open_ts):
+        if ts in fresh:
+            continue
+        if not budget.spend():
+            return False
+        response = workspace.client.conversations_history(
+            channel=channel, oldest=ts, latest=ts, inclusive=True, limit=1,
+            include_all_metadata=True
+        )
+        messages = response.get('messages', [])
+        # Checked ones go to the back, so a long list is covered over several sweeps
+        open_ts.remove(ts)
+        if not messages:
+            # Deleted
+            continue
+        if not _handle_message(workspace, channel, messages[0], open_ts, budget, bot_user_id):
+            return False
+    return True
+
+
+def _sweep_channel(workspace, channel, team_state, budget, bot_user_id):
+    """Check one channel's new messages and open notifications; return False if out of budget"""
+    cutoff = time.time() - RECONCILE_MAX_AGE
+    open_ts = [ts for ts in team_state["open"].get(channel, []) if float(ts) >= cutoff]
+    team_state["open"][channel] = open_ts
+
+    # Messages read from history already had their reactions checked
+    fresh = set()
+    return (_read_new_messages(workspace, channel, team_state, open_ts, budget, bot_user_id, fresh)
+            and _check_open(workspace, channel, open_ts, budget, bot_user_id, fresh))
+
+
+@traced("reconcile_workspace")
+def reconcile_workspace(workspace):
+    """Apply claims missed since the last sweep for one workspace"""
+    budget = _CallBudget(workspace)
+    bot_user_id, _ = workspace.bot_identity()
+
+    with _state_lock:
+        team_state = _team_state(workspace.team_id)
+        channels = set(team_state["cursors"]) | set(team_state["open"])
+        channels |= set(workspace.installation.get('reconcile_channels', []))
+        channels = sorted(channels)
+
+        # Start each sweep at the next channel so one busy channel can't
+        # use up the budget every time
+        if channels:
+            start = team_state.get("rotation", 0) % len(channels)
+            team_state["rotation"] = start + 1
+            channels = channels[start:] + channels[:start]
+
+        try:
+            for index, channel in enumerate(channels):
+                try:
+                    complete = _sweep_channel(workspace, channel, team_state, budget, bot_user_id)
+                except SlackApiError as e:
+                    # e.g. the bot was removed from this channel; the others still get swept
+                    logger.error(f"Reconcile sweep failed for team {workspace.team_id} in {channel}: "
+                                 f"{e.response['error']}")
+                    continue
+                if not complete:
+                    logger.warning(f"Reconcile budget exhausted for team {workspace.team_id} in {channel}, "
+                                   f"{len(channels) - index - 1} channels left for the next sweep")
+                    break
+        finally:
+            _save_state()
+
+    logger.info(f"Reconcile sweep for team {workspace.team_id} used "
+                f"{RECONCILE_CALLS_PER_SWEEP - budget.remaining} API calls")
+
+
+def reconcile_all():
+    """Run a sweep for every workspace with state or currently in use"""
+    if not _is_leader():
+        return
+
+    with _state_lock:
+        _load_state()
+        _merge_pending()
+        _save_state()
+        team_ids = set(_state)
+    workspaces = {workspace.team_id: workspace for workspace in cached_workspaces()}
+    for team_id in team_ids - set(workspaces):
+        try:
+            workspaces[team_id] = get_workspace(team_id)
+        except UnknownTeamError:
+            logger.warning(f"Skipping reconcile for uninstalled team {team_id}")
+
+    for workspace in workspaces.values():
+        try:
+            reconcile_workspace(workspace)
+        except Exception as e:
+            logger.error(f"Unexpected error reconciling team {workspace.team_id}: {str(e)}")
+
+
+def _sweep_loop():
+    while not _stop_event.wait(RECONCILE_INTERVAL):
+        reconcile_all()
+
+
+def start_reconciliation_sweeper():
+    """Start the background sweep thread if this instance is allowed to sweep"""
+    global _sweeper
+    if not RECONCILE_SWEEPER:
+        logger.info("Reconciliation sweeper disabled by RECONCILE_SWEEPER")
+        return None
+    if _sweeper is not None and _sweeper.is_alive():
+        return _sweeper
+
+    _stop_event.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, name="reconciliation-sweeper", daemon=True)
+    _sweeper.start()
+    return _sweeper
+
+
+def stop_reconciliation_sweeper():
+    """Signal the background sweep thread to exit"""
+    _stop_event.set()
@@ -5,6 +5,8 @@ from slack_sdk.errors import SlackApiError
 import logging
 from dotenv import load_dotenv
 from pr_review_bot import TEAM_MEMBERS, notify_pr_review, CLAIM_EMOJI
+from workspaces import get_client, SLACK_INSTALLATIONS_FILE
+from tracing import traced, SPAN_KIND_SERVER
 
 # Load environment variables
 load_dotenv()
@@ -21,12 +23,11 @@ app = Flask(__name__)
 
 # Slack configuration
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
-if not SLACK_BOT_TOKEN:
-    logger.error("SLACK_BOT_TOKEN not found in environment variables")
-    raise ValueError("SLACK_BOT_TOKEN must be set")
-
-client = WebClient(token=SLACK_BOT_TOKEN)
+if not SLACK_BOT_TOKEN and not SLACK_INSTALLATIONS_FILE:
+    logger.error("Neither SLACK_BOT_TOKEN nor SLACK_INSTALLATIONS_FILE found in environment variables")
+    raise ValueError("SLACK_BOT_TOKEN or SLACK_INSTALLATIONS_FILE must be set")
 
+@traced("handle_slash_command", kind=SPAN_KIND_SERVER)
 def handle_slash_command():
     """Process incoming Slack slash commands"""
     data = request.form
@@ -36,6 +37,7 @@ def handle_slash_command():
     command = data.get('command')
     channel_id = data.get('channel_id')
     user_id = data.get('user_id')
+    team_id = data.get('team_id')
     text = data.get('text', '')
     
     if command == '/pr':
@@ -57,7 +59,8 @@ def handle_slash_command():
             'repository': title,
             'author': f"<@{user_id}>",
             'url': url,
-            'channel': channel_id
+            'channel': channel_id,
+            'team_id': team_id
         }
         
         response_data = {"response_type": "ephemeral", "text": "Processing your PR review request..."}
@@ -72,7 +75,7 @@ def handle_slash_command():
     
     return jsonify({"response_type": "ephemeral", "text": "Unknown command"})
 
-def handle_pr_command(text, user_id):
+def handle_pr_command(text, user_id, team_id=None):
     """Create a new PR review request from slash command text"""
     parts = text.strip().split(' ', 1)
     
@@ -86,7 +89,7 @@ def handle_pr_command(text, user_id):
     title = parts[1]
     
     try:
-        user_info = client.users_info(user=user_id)
+        user_info = get_client(team_id).users_info(user=user_id)
         author = user_info['user']['name']
     except SlackApiError:
         author = "Unknown"
@@ -104,11 +107,11 @@ def handle_pr_command(text, user_id):
         'text': message
     })
 
-def select_reviewers_safely(author_id=None):
+def select_reviewers_safely(author_id=None, team_id=None):
     """Safely select reviewers, handling any exceptions"""
     try:
         from pr_review_bot import select_reviewers, CLAIM_EMOJI
-        return select_reviewers(author_id)
+        return select_reviewers(author_id, team_id=team_id)
     except Exception as e:
         logger.error(f"Error selecting reviewers: {e}")
         return []
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+import requests as http
+from flask import request, has_request_context
+from slack_sdk import WebClient
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Where finished traces go: an OTLP/JSON lines file and/or an OTLP/HTTP collector
+# (e.g. http://localhost:4318/v1/traces). Spans are not exported if neither is set.
+TRACE_FILE = os.environ.get("TRACE_FILE")
+OTLP_ENDPOINT = os.environ.get("OTLP_ENDPOINT")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "slack-pr-bot")
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_queue = queue.Queue()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+class Span:
+    """A single timed operation within a trace"""
+
+    def __init__(self, name, trace_id, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.links = []
+        self.status_code = STATUS_OK
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        # Root spans collect every finished span of their trace for export
+        self.finished = [] if parent is None else parent.finished
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def add_link(self, trace_id, span_id):
+        """Link this span to a span in another trace, e.g. the PR a claim belongs to"""
+        if trace_id and span_id:
+            self.links.append((trace_id, span_id))
+
+    def record_error(self, error):
+        self.status_code = STATUS_ERROR
+        self.status_message = str(error)
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.finished.append(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status_code},
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        if self.links:
+            span["links"] = [{"traceId": t, "spanId": s} for t, s in self.links]
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def trace_id_from(correlation_id):
+    """Derive a 32-hex-digit OTLP trace ID from a delivery/event ID"""
+    if not correlation_id:
+        return uuid.uuid4().hex
+    # X-GitHub-Delivery is already a UUID; Slack event_ids are not hex, so hash them
+    candidate = correlation_id.replace('-', '').lower()
+    if len(candidate) == 32 and all(c in '0123456789abcdef' for c in candidate):
+        return candidate
+    return hashlib.sha256(correlation_id.encode()).hexdigest()[:32]
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(name, correlation_id=None, kind=SPAN_KIND_INTERNAL, **attributes):
+    """Open a span under the current one, or a new trace if there is none"""
+    parent = _current_span.get()
+    if parent is None:
+        trace_id = trace_id_from(correlation_id)
+        if correlation_id:
+            attributes.setdefault('correlation.id', correlation_id)
+        span = Span(name, trace_id, kind=kind, attributes=attributes)
+        logger.info(f"Trace {trace_id} started for {name} (correlation id {correlation_id})")
+    else:
+        span = Span(name, parent.trace_id, parent=parent, kind=kind, attributes=attributes)
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+        if parent is None:
+            _export(span.finished)
+
+
+def _request_correlation_id():
+    """Pick the upstream delivery/event ID for the current Flask request"""
+    if not has_request_context():
+        return None
+    delivery = request.headers.get('X-GitHub-Delivery')
+    if delivery:
+        return delivery
+    payload = request.get_json(silent=True) or {}
+    return payload.get('event_id') or request.form.get('trigger_id')
+
+
+def _response_status(result):
+    """Return the HTTP status of a Flask view's return value"""
+    if isinstance(result, tuple):
+        if len(result) > 1 and isinstance(result[1], int):
+            return result[1]
+        result = result[0] if result else None
+    return getattr(result, 'status_code', 200)
+
+
+def traced(name, kind=SPAN_KIND_INTERNAL):
+    """Decorator wrapping a handler in a span; ingress handlers start the trace"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            correlation_id = _request_correlation_id() if current_span() is None else None
+            with start_span(name, correlation_id=correlation_id, kind=kind) as span:
+                result = func(*args, **kwargs)
+                if kind == SPAN_KIND_SERVER:
+                    # Views report failures as error responses rather than exceptions
+                    status = _response_status(result)
+                    span.set_attribute('http.status_code', status)
+                    if status >= 400:
+                        span.record_error(f"HTTP {status}")
+                return result
+        return wrapper
+    return decorator
+
+
+class TracedWebClient(WebClient):
+    """WebClient that records a client span for every Web API call made inside a trace"""
+
+    def api_call(self, api_method, *args, **kwargs):
+        if current_span() is None:
+            return super().api_call(api_method, *args, **kwargs)
+
+        with start_span(f"slack.{api_method}", kind=SPAN_KIND_CLIENT, **{'slack.method': api_method}) as span:
+            response = super().api_call(api_method, *args, **kwargs)
+            span.set_attribute('slack.ok', response.get('ok'))
+            span.set_attribute('http.status_code', response.status_code)
+            return response
+
+
+def _export(spans):
+    if not (TRACE_FILE or OTLP_ENDPOINT):
+        return
+    _ensure_exporter()
+    _export_queue.put(spans)
+
+
+def _ensure_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None or not _exporter.is_alive():
+            _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+            _exporter.start()
+
+
+def _export_loop():
+    # Export off the request path so tracing never adds latency to a handler
+    while True:
+        spans = _export_queue.get()
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": SERVICE_NAME},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+        if TRACE_FILE:
+            try:
+                with open(TRACE_FILE, 'a') as f:
+                    f.write(json.dumps(body) + "\n")
+            except OSError as e:
+                logger.error(f"Failed to write trace file {TRACE_FILE}: {e}")
+        if OTLP_ENDPOINT:
+            try:
+                http.post(OTLP_ENDPOINT, json=body, timeout=5)
+            except http.RequestException as e:
+                logger.error(f"Failed to export trace to {OTLP_ENDPOINT}: {e}")
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from tracing import TracedWebClient
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# JSON file mapping Slack team_id -> installation record, e.g.
+# {
+#   "T0001": {
+#     "bot_token": "xoxb-...",
+#     "channel": "pr-reviews",
+#     "primary_reviewer": ["Nigel", "UR78CM4LX"],
+#     "team_members": {"Sally": "U048MPX0KK7"},
+#     "github_to_slack": {"huisi": "U048MPX0KK7"},
+#     "rate_limit_per_minute": 50
+#   }
+# }
+SLACK_INSTALLATIONS_FILE = os.environ.get("SLACK_INSTALLATIONS_FILE")
+
+# Team used when a request carries no team_id (single-workspace deployments)
+DEFAULT_TEAM_ID = os.environ.get("SLACK_TEAM_ID", "default")
+
+# Maximum number of tenants kept warm in the workspace cache
+WORKSPACE_CACHE_SIZE = int(os.environ.get("WORKSPACE_CACHE_SIZE", "64"))
+
+# Default per-tenant Slack Web API budget (calls per minute)
+DEFAULT_RATE_LIMIT_PER_MINUTE = int(os.environ.get("SLACK_RATE_LIMIT_PER_MINUTE", "50"))
+
+# Installations registered in code (e.g. the legacy single-token install)
+_registered_installations = {}
+
+# How long a team_id with no installation is remembered as unknown (seconds)
+UNKNOWN_TEAM_TTL = int(os.environ.get("UNKNOWN_TEAM_TTL", "300"))
+
+# LRU of team_id -> Workspace
+_workspace_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# team_id -> TenantState; outlives cache eviction so budgets and rotation persist
+_tenant_states = {}
+
+# team_id -> monotonic expiry for teams with no installation (negative cache),
+# oldest first and never longer than UNKNOWN_TEAM_CACHE_SIZE
+UNKNOWN_TEAM_CACHE_SIZE = int(os.environ.get("UNKNOWN_TEAM_CACHE_SIZE", "1000"))
+_unknown_teams = OrderedDict()
+
+# How often to check SLACK_INSTALLATIONS_FILE for changes (seconds)
+INSTALLATIONS_RELOAD_INTERVAL = float(os.environ.get("INSTALLATIONS_RELOAD_INTERVAL", "5"))
+
+# (mtime, parsed contents) of SLACK_INSTALLATIONS_FILE, and when it was last checked
+_installations_file_cache = (None, {})
+_installations_checked_at = None
+
+
+class UnknownTeamError(LookupError):
+    """Raised when a team_id has no Slack installation"""
+
+
+class RateLimitBudget:
+    """Token bucket limiting how many Slack calls a tenant may make per minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = max(1, int(per_minute))
+        self.tokens = float(self.capacity)
+        self.refill_rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def try_acquire(self, cost=1):
+        """Take `cost` tokens if available, returning False when over budget"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return True
+            return False
+
+    def acquire(self, cost=1, timeout=None):
+        """Block until `cost` tokens are available or `timeout` seconds pass"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire(cost):
+            with self._lock:
+                wait = (cost - self.tokens) / self.refill_rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+        return True
+
+
+class TenantState:
+    """Per-tenant counters that must survive a Workspace being evicted from the cache"""
+
+    def __init__(self, rate_limit_per_minute):
+        self.rate_limit = RateLimitBudget(rate_limit_per_minute)
+        # Last selected reviewers to ensure fair rotation within this tenant
+        self.last_selected = []
+
+
+def _tenant_state(team_id, installation):
+    with _cache_lock:
+        state = _tenant_states.get(team_id)
+        if state is None:
+            state = TenantState(installation.get('rate_limit_per_minute', DEFAULT_RATE_LIMIT_PER_MINUTE))
+            _tenant_states[team_id] = state
+        return state
+
+
+class Workspace:
+    """Per-tenant view: installation record, pooled client, rate budget and roster"""
+
+    def __init__(self, team_id, installation):
+        self.team_id = team_id
+        self.installation = installation
+        self.client = TracedWebClient(token=installation.get('bot_token'))
+        self.channel = installation.get('channel')
+        self.state = _tenant_state(team_id, installation)
+        self.rate_limit = self.state.rate_limit
+
+        primary = installation.get('primary_reviewer') or [None, None]
+        self.primary_reviewer = (primary[0], primary[1])
+        self.team_members = dict(installation.get('team_members', {}))
+        self.github_to_slack = dict(installation.get('github_to_slack', {}))
+
+        # The bot's own identity, filled from the install record or a single auth_test
+        self.bot_user_id = installation.get('bot_user_id')
+        self.bot_id = installation.get('bot_id')
+
+    @property
+    def last_selected(self):
+        return self.state.last_selected
+
+    @last_selected.setter
+    def last_selected(self, value):
+        self.state.last_selected = value
+
+    def bot_identity(self):
+        """Return (bot_user_id, bot_id), calling auth_test at most once per workspace"""
+        if self.bot_user_id is None:
+            response = self.client.auth_test()
+            self.bot_user_id = response.get('user_id')
+            self.bot_id = response.get('bot_id')
+        return self.bot_user_id, self.bot_id
+
+
+def register_installation(team_id, installation):
+    """Register an installation record in code, replacing any cached workspace"""
+    _registered_installations[team_id] = installation
+    with _cache_lock:
+        _workspace_cache.pop(team_id, None)
+        _unknown_teams.pop(team_id, None)
+
+
+def _refresh_installations_file():
+    """Re-read the installations file if it changed, dropping every cached workspace"""
+    global _installations_file_cache, _installations_checked_at
+    now = time.monotonic()
+    if _installations_checked_at is not None and now - _installations_checked_at < INSTALLATIONS_RELOAD_INTERVAL:
+        return
+    _installations_checked_at = now
+
+    try:
+        mtime = os.path.getmtime(SLACK_INSTALLATIONS_FILE)
+        if mtime == _installations_file_cache[0]:
+            return
+        with open(SLACK_INSTALLATIONS_FILE) as f:
+            installations = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to read installations file {SLACK_INSTALLATIONS_FILE}: {e}")
+        return
+
+    with _cache_lock:
+        changed = _installations_file_cache[0] is not None
+        _installations_file_cache = (mtime, installations)
+        # Rotated tokens, removed installs and roster edits take effect now;
+        # budgets and rotation live in _tenant_states and carry over
+        _workspace_cache.clear()
+        _unknown_teams.clear()
+    if changed:
+        logger.info(f"Reloaded installations file {SLACK_INSTALLATIONS_FILE}")
+
+
+def _load_installation(team_id):
+    """Look up the installation record for a team, or None if it isn't installed"""
+    if SLACK_INSTALLATIONS_FILE:
+        installation = _installations_file_cache[1].get(team_id)
+        if installation is not None:
+            return installation
+
+    return _registered_installations.get(team_id)
+
+
+def get_workspace(team_id=None, cache=True):
+    """Return the cached Workspace for a team, building it on first use
+
+    Background jobs that visit every tenant pass cache=False so they don't
+    evict the workspaces serving live traffic.
+    """
+    team_id = team_id or DEFAULT_TEAM_ID
+    if SLACK_INSTALLATIONS_FILE:
+        _refresh_installations_file()
+
+    with _cache_lock:
+        workspace = _workspace_cache.get(team_id)
+        if workspace is not None:
+            _workspace_cache.move_to_end(team_id)
+            return workspace
+        unknown_until = _unknown_teams.get(team_id)
+
+    # Single-workspace deployments have no installations file, so every
+    # team_id Slack sends us belongs to the legacy default install
+    fall_back = team_id != DEFAULT_TEAM_ID and not SLACK_INSTALLATIONS_FILE
+
+    if unknown_until is not None and time.monotonic() < unknown_until:
+        if fall_back:
+            return get_workspace(DEFAULT_TEAM_ID, cache)
+        raise UnknownTeamError(f"No Slack installation registered for team {team_id}")
+
+    installation = _load_installation(team_id)
+    if installation is None:
+        with _cache_lock:
+            _unknown_teams.pop(team_id, None)
+            _unknown_teams[team_id] = time.monotonic() + UNKNOWN_TEAM_TTL
+            while len(_unknown_teams) > UNKNOWN_TEAM_CACHE_SIZE:
+                _unknown_teams.popitem(last=False)
+        if fall_back:
+            return get_workspace(DEFAULT_TEAM_ID, cache)
+        raise UnknownTeamError(f"No Slack installation registered for team {team_id}")
+
+    workspace = Workspace(team_id, installation)
+    if not cache:
+        return workspace
+    logger.info(f"Initialized workspace for team {team_id}")
+
+    with _cache_lock:
+        # Another thread may have built it while we were loading
+        existing = _workspace_cache.get(team_id)
+        if existing is not None:
+            _workspace_cache.move_to_end(team_id)
+            return existing
+        _workspace_cache[team_id] = workspace
+        while len(_workspace_cache) > WORKSPACE_CACHE_SIZE:
+            evicted, _ = _workspace_cache.popitem(last=False)
+            logger.info(f"Evicted workspace for team {evicted} from cache")
+
+    return workspace
+
+
+def installed_team_ids():
+    """Return the team_id of every known installation"""
+    if SLACK_INSTALLATIONS_FILE:
+        _refresh_installations_file()
+    return set(_installations_file_cache[1]) | set(_registered_installations)
+
+
+def cached_workspaces():
+    """Return a snapshot of the workspaces currently held in the cache"""
+    with _cache_lock:
+        return list(_workspace_cache.values())
+
+
+def get_client(team_id=None):
+    """Return the pooled WebClient for a team"""
+    return get_workspace(team_id).client